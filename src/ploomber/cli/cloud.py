@@ -142,7 +142,8 @@ def _write_pipeline(pipeline_id,
     # Write pipeline API call
     conn = httplib.HTTPSConnection(CLOUD_APP_URL, timeout=3)
     try:
-        headers['api_key'] = key
+        # copy the headers, the module-level ones are shared across threads
+        request_headers = {**headers, 'api_key': key}
         body = {
             "pipeline_id": pipeline_id,
             "status": status,
@@ -156,7 +157,7 @@ def _write_pipeline(pipeline_id,
         conn.request("POST",
                      PIPELINES_RESOURCE,
                      body=json.dumps(body),
-                     headers=headers)
+                     headers=request_headers)
         res = conn.getresponse()
 
         content = res.read().decode('utf-8')
@@ -178,6 +179,10 @@ def delete_pipeline(pipeline_id):
     The response is the pipeline id if the update was successful.
     If the pipeline wasn't written/updated, the result will contain the error.
     """
+    return _delete_pipeline(pipeline_id)
+
+
+def _delete_pipeline(pipeline_id):
     # Validate inputs
     key = get_key()
     if not key:
@@ -188,9 +193,11 @@ def delete_pipeline(pipeline_id):
     # Delete pipeline API call
     conn = httplib.HTTPSConnection(CLOUD_APP_URL, timeout=3)
     try:
-        headers['api_key'] = key
-        headers['pipeline_id'] = pipeline_id
-        conn.request("DELETE", PIPELINES_RESOURCE, headers=headers)
+        request_headers = {
+            **headers, 'api_key': key,
+            'pipeline_id': pipeline_id
+        }
+        conn.request("DELETE", PIPELINES_RESOURCE, headers=request_headers)
 
         res = conn.getresponse()
         content = ''
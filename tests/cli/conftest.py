@@ -0,0 +1,239 @@
+"""
+Fixtures for testing the cloud CLI (ploomber cloud)
+"""
+import json
+import time
+import uuid
+from contextlib import contextmanager
+import http.client as httplib
+from unittest.mock import Mock
+
+import pytest
+
+from ploomber.cli import cloud
+from ploomber.telemetry import telemetry
+from ploomber.telemetry.telemetry import DEFAULT_USER_CONF
+
+
+@pytest.fixture(scope='session')
+def sample_conf_home(tmp_path_factory):
+    """
+    Creates a home directory with a sample config file, only once per session
+    """
+    home = tmp_path_factory.mktemp('stats_home')
+    stats = home / 'stats'
+    stats.mkdir()
+    (stats / DEFAULT_USER_CONF).write_text("stats_enabled: False")
+    return home
+
+
+@pytest.fixture(scope='module')
+def mock_home_dir(sample_conf_home):
+    """
+    Mocks the default location for the config file, for all the tests in the
+    module
+    """
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(telemetry, 'DEFAULT_HOME_DIR', str(sample_conf_home))
+        yield sample_conf_home
+
+
+@pytest.fixture
+def write_sample_conf(mock_home_dir):
+    """
+    Restores the default content of the config file after each test, since
+    most tests modify it. Returns the path to the config file
+    """
+    full_path = mock_home_dir / 'stats' / DEFAULT_USER_CONF
+    original = full_path.read_text()
+
+    yield full_path
+
+    full_path.write_text(original)
+
+
+API_KEY = 'TEST_KEY_VALID12345678'
+
+
+class MockHTTPResponse:
+    def __init__(self, status, content):
+        self.status = status
+        self._content = content
+
+    def read(self):
+        return self._content.encode('utf-8')
+
+
+class MockHTTPSConnection:
+    def __init__(self, api, host, timeout=None):
+        self.api = api
+        self.host = host
+        self.timeout = timeout
+        self._response = None
+
+    def request(self, method, url, body=None, headers=None):
+        if self.host != cloud.CLOUD_APP_URL:
+            raise ConnectionRefusedError(f'Cannot connect to {self.host!r}')
+
+        status, content = self.api.handle(method, url, body, dict(headers))
+        self._response = MockHTTPResponse(status, content)
+
+    def getresponse(self):
+        return self._response
+
+    def close(self):
+        pass
+
+
+class MockCloudAPI:
+    """
+    In-memory replacement for the cloud pipelines API, pipelines are stored
+    in a dictionary (keyed by pipeline_id)
+    """
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.pipelines = {}
+        self.calls = []
+        self.headers = []
+
+    def connect(self, host, timeout=None):
+        return MockHTTPSConnection(self, host, timeout=timeout)
+
+    def handle(self, method, url, body, headers):
+        self.calls.append((method, url))
+        self.headers.append(headers)
+
+        if headers.get('api_key') != self.api_key:
+            return 401, 'API_Key not valid'
+
+        if method == 'POST':
+            return self._write(json.loads(body))
+        elif method == 'GET':
+            return self._get(headers.get('pipeline_id'),
+                             headers.get('verbose'))
+        elif method == 'DELETE':
+            return self._delete(headers.get('pipeline_id'))
+        else:
+            return 405, f'Method {method} not allowed'
+
+    def _write(self, body):
+        pipeline_id = body['pipeline_id']
+        pipeline = self.pipelines.setdefault(pipeline_id, {})
+        pipeline.update(body)
+        pipeline['updated'] = str(time.time())
+        return 200, f'Pipeline {pipeline_id} was written'
+
+    def _get(self, pipeline_id, verbose):
+        pipelines = list(self.pipelines.values())
+
+        if pipeline_id == 'latest':
+            pipelines = sorted(pipelines,
+                               key=lambda p: float(p['updated']))[-1:]
+        elif pipeline_id == 'active':
+            pipelines = [p for p in pipelines if p['status'] == 'started']
+        elif pipeline_id:
+            if pipeline_id not in self.pipelines:
+                return 404, f'Pipeline {pipeline_id} was not found'
+
+            pipelines = [self.pipelines[pipeline_id]]
+
+        if not verbose:
+            pipelines = [{k: v
+                          for k, v in p.items() if k != 'dag'}
+                         for p in pipelines]
+
+        return 200, json.dumps(pipelines)
+
+    def _delete(self, pipeline_id):
+        if pipeline_id not in self.pipelines:
+            return 404, f'Pipeline {pipeline_id} doesn\'t exist'
+
+        del self.pipelines[pipeline_id]
+        return 200, f'Pipeline {pipeline_id} was deleted'
+
+
+@pytest.fixture(scope='module')
+def mock_cloud_http():
+    """
+    Replaces the HTTPS connections to the cloud API with an in-memory mock so
+    tests don't make network calls. Only connections to the cloud API
+    succeed
+    """
+    api = MockCloudAPI(API_KEY)
+
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(httplib, 'HTTPSConnection', api.connect)
+        yield api
+
+
+@pytest.fixture
+def mock_api_key(monkeypatch):
+    monkeypatch.setattr(cloud, 'get_key', Mock(return_value=API_KEY))
+    return API_KEY
+
+
+def _make_pid(nodeid, suffix):
+    """
+    Generates a pipeline id, derived from the node id so it's deterministic
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f'{nodeid}:{suffix}'))
+
+
+@contextmanager
+def _valid_api_key():
+    """
+    Mocks the API key for fixtures that write or delete pipelines outside
+    a test (mock_api_key is function-scoped)
+    """
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(cloud, 'get_key', Mock(return_value=API_KEY))
+        yield
+
+
+@pytest.fixture(scope='module')
+def pipeline_ids(mock_cloud_http):
+    """
+    Collects the ids of the pipelines written by the tests, they're deleted
+    once all the tests in the module run
+    """
+    pids = []
+
+    yield pids
+
+    with _valid_api_key():
+        for pid in pids:
+            res = cloud._delete_pipeline(pid)
+            assert pid in res
+
+
+@pytest.fixture(scope='module')
+def sample_pipeline(mock_cloud_http, request):
+    """
+    Writes a pipeline (with started status) that's shared by the tests that
+    only read it, it's deleted once all the tests in the module run
+    """
+    pid = _make_pid(request.node.nodeid, 'sample')
+
+    with _valid_api_key():
+        assert pid in cloud._write_pipeline(pid, 'started')
+
+    yield pid
+
+    with _valid_api_key():
+        assert pid in cloud._delete_pipeline(pid)
+
+
+@pytest.fixture
+def pid_factory(request):
+    """
+    Returns a function that generates pipeline ids, they're derived from the
+    test's node id so they're deterministic
+    """
+    counter = 0
+
+    def factory():
+        nonlocal counter
+        counter += 1
+        return _make_pid(request.node.nodeid, counter)
+
+    return factory
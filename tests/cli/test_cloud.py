@@ -1,115 +1,84 @@
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock
-from pathlib import Path
 import pytest
-import yaml
 from click.testing import CliRunner
 
 from ploomber.cli import cloud, examples
 from ploomber_cli.cli import get_key, set_key, write_pipeline, get_pipelines,\
                             delete_pipeline
 from ploomber.telemetry import telemetry
-from ploomber.telemetry.telemetry import DEFAULT_USER_CONF
 from ploomber import table
 
 
-@pytest.fixture(autouse=True)
-def write_sample_conf(tmp_directory, monkeypatch):
-    """
-    Mocks the default location for the config file, and stores some
-    default content
-    """
-    # back up user config to prevent the tests from modifying it (the tests
-    # shouldn't access it directly but this is more robust)
-    user_config = Path(telemetry.DEFAULT_HOME_DIR, 'stats', DEFAULT_USER_CONF)
-    file_exists = user_config.exists()
+pytestmark = pytest.mark.usefixtures('write_sample_conf', 'mock_cloud_http')
 
-    if file_exists:
-        content = yaml.safe_load(user_config.read_text())
 
-    monkeypatch.setattr(telemetry, 'DEFAULT_HOME_DIR', '.')
-    stats = Path('stats')
-    stats.mkdir()
-    full_path = (stats / DEFAULT_USER_CONF)
-    full_path.write_text("stats_enabled: False")
-
-    yield
-
-    if file_exists:
-        with user_config.open('w') as f:
-            yaml.safe_dump(content, f)
+# a single runner is shared by the helpers and the tests, no need to create
+# one per invocation
+_RUNNER = CliRunner()
 
 
+# the following helpers call the commands directly (no need to go through
+# CliRunner), use capsys to read their output
 def write_sample_pipeline(pipeline_id=None, status=None):
-    runner = CliRunner()
-    result = runner.invoke(write_pipeline,
-                           args=[pipeline_id, status],
-                           catch_exceptions=False)
-
-    return result.stdout
+    write_pipeline.callback(pipeline_id=pipeline_id,
+                            status=status,
+                            log=None,
+                            pipeline_name=None,
+                            dag=None)
 
 
 def delete_sample_pipeline(pipeline_id=None):
-    runner = CliRunner()
-    res = runner.invoke(delete_pipeline, args=[pipeline_id])
-    return res.stdout
+    delete_pipeline.callback(pipeline_id=pipeline_id)
 
 
 def get_tabular_pipeline(pipeline_id=None, verbose=None):
-    runner = CliRunner()
     if pipeline_id:
         args = [pipeline_id]
     else:
         args = []
     if verbose:
         args.append(verbose)
-    res = runner.invoke(get_pipelines, args=args, catch_exceptions=False)
+    res = _RUNNER.invoke(get_pipelines, args=args, catch_exceptions=False)
     return res.stdout
 
 
-def test_write_api_key():
+def test_write_api_key(write_sample_conf):
     key_val = "TEST_KEY12345678987654"
     key_name = "cloud_key"
-    full_path = (Path('stats') / DEFAULT_USER_CONF)
+    full_path = write_sample_conf
 
     # Write cloud key to existing file, assert on key/val
     cloud.set_key(key_val)
-    with full_path.open("r") as file:
-        conf = yaml.safe_load(file)
 
-    assert key_name in conf.keys()
-    assert key_val in conf[key_name]
+    assert f'{key_name}: {key_val}' in full_path.read_text()
 
 
-def test_write_key_no_conf_file(tmp_directory, monkeypatch):
+def test_write_key_no_conf_file(write_sample_conf):
     key_val = "TEST_KEY12345678987654"
     key_name = "cloud_key"
-    monkeypatch.setattr(telemetry, 'DEFAULT_HOME_DIR', '.')
-    full_path = (Path('stats') / DEFAULT_USER_CONF)
+    full_path = write_sample_conf
+    full_path.unlink()
 
     # Write cloud key to existing file, assert on key/val
     cloud._set_key(key_val)
-    with full_path.open("r") as file:
-        conf = yaml.safe_load(file)
 
-    assert key_name in conf.keys()
-    assert key_val in conf[key_name]
+    assert f'{key_name}: {key_val}' in full_path.read_text()
 
 
-def test_overwrites_api_key():
+def test_overwrites_api_key(write_sample_conf):
     key_val = "TEST_KEY12345678987654"
     key_name = "cloud_key"
-    full_path = (Path('stats') / DEFAULT_USER_CONF)
+    full_path = write_sample_conf
     cloud.set_key(key_val)
 
     # Write cloud key to existing file, assert on key/val
     another_val = "SEC_KEY123456789876543"
     cloud.set_key(another_val)
-    with full_path.open("r") as file:
-        conf = yaml.safe_load(file)
+    conf = full_path.read_text()
 
-    assert key_name in conf.keys()
-    assert another_val in conf[key_name]
+    assert f'{key_name}: {another_val}' in conf
+    assert key_val not in conf
 
 
 @pytest.mark.parametrize('arg', [None, '12345'])
@@ -120,15 +89,14 @@ def test_api_key_well_formatted(arg):
     assert 'The API key is malformed' in str(excinfo.value)
 
 
-def test_get_api_key(monkeypatch, capsys):
+def test_get_api_key(monkeypatch):
     monkeypatch.delenv('PLOOMBER_CLOUD_KEY', raising=False)
 
     key_val = "TEST_KEY12345678987654"
-    runner = CliRunner()
-    result = runner.invoke(set_key, args=[key_val], catch_exceptions=False)
+    result = _RUNNER.invoke(set_key, args=[key_val], catch_exceptions=False)
     assert 'Key was stored\n' in result.stdout
 
-    result = runner.invoke(get_key, catch_exceptions=False)
+    result = _RUNNER.invoke(get_key, catch_exceptions=False)
     assert key_val in result.stdout
 
 
@@ -136,40 +104,36 @@ def test_get_api_key_from_env_var(monkeypatch):
     key_val = 'TEST_KEY12345678987654'
     monkeypatch.setenv('PLOOMBER_CLOUD_KEY', key_val)
 
-    runner = CliRunner()
-    result = runner.invoke(set_key,
-                           args=["XXXX_KEY12345678987654"],
-                           catch_exceptions=False)
+    result = _RUNNER.invoke(set_key,
+                            args=["XXXX_KEY12345678987654"],
+                            catch_exceptions=False)
     assert 'Key was stored\n' in result.stdout
 
-    result = runner.invoke(get_key, catch_exceptions=False)
+    result = _RUNNER.invoke(get_key, catch_exceptions=False)
     assert key_val in result.stdout
 
 
-def test_get_no_key(monkeypatch, capsys):
+def test_get_no_key(monkeypatch):
     monkeypatch.delenv('PLOOMBER_CLOUD_KEY', raising=False)
 
-    runner = CliRunner()
-    result = runner.invoke(get_key, catch_exceptions=False)
+    result = _RUNNER.invoke(get_key, catch_exceptions=False)
 
     assert 'No cloud API key was found.\n' == result.stdout
 
 
-def test_two_keys_not_supported(monkeypatch, capsys):
+def test_two_keys_not_supported(write_sample_conf, monkeypatch):
     monkeypatch.delenv('PLOOMBER_CLOUD_KEY', raising=False)
 
     key_val = "TEST_KEY12345678987654"
     key2 = 'SEC_KEY12345678987654'
-    runner = CliRunner()
-    runner.invoke(set_key, args=[key_val], catch_exceptions=False)
+    _RUNNER.invoke(set_key, args=[key_val], catch_exceptions=False)
 
     # Write a second key (manual on file by user)
-    full_path = (Path('stats') / DEFAULT_USER_CONF)
-    print(full_path)
+    full_path = write_sample_conf
     conf = full_path.read_text()
     conf += f'cloud_key: {key2}\n'
     full_path.write_text(conf)
-    res = runner.invoke(get_key, catch_exceptions=False)
+    res = _RUNNER.invoke(get_key, catch_exceptions=False)
 
     # By the yaml default, it'll take the latest key
     assert key2 in res.stdout
@@ -177,133 +141,124 @@ def test_two_keys_not_supported(monkeypatch, capsys):
 
 def test_cloud_user_tracked():
     key_val = "TEST_KEY12345678987654"
-    runner = CliRunner()
-    runner.invoke(set_key, args=[key_val], catch_exceptions=False)
+    _RUNNER.invoke(set_key, args=[key_val], catch_exceptions=False)
 
     assert key_val == telemetry.is_cloud_user()
 
 
-@pytest.mark.xfail(reason="timing out")
-def test_get_pipeline(monkeypatch):
-    # Write sample pipeline
-    pid = str(uuid.uuid4())
-    status = 'started'
-    res = write_sample_pipeline(pid, status)
-    assert pid in res
-
-    pipeline = cloud.get_pipeline(pid, status)
+def test_get_pipeline(mock_api_key, sample_pipeline):
+    pipeline = cloud.get_pipeline(sample_pipeline)
     assert isinstance(pipeline, list)
-    assert pid == pipeline[0]['pipeline_id']
-
-    res = delete_sample_pipeline(pid)
-    assert pid in res
+    assert sample_pipeline == pipeline[0]['pipeline_id']
+    assert pipeline[0]['status'] == 'started'
 
 
-def test_get_pipeline_no_key(tmp_directory, monkeypatch):
+def test_get_pipeline_no_key(monkeypatch, mock_cloud_http, pid_factory):
     key = "TEST_KEY"
-    sample_pipeline_id = str(uuid.uuid4())
+    sample_pipeline_id = pid_factory()
     cloud_mock = Mock(return_value=key)
     monkeypatch.setattr(cloud, 'get_key', cloud_mock)
     pipeline = get_tabular_pipeline(sample_pipeline_id)
     assert isinstance(pipeline, str)
     assert 'API_Key not valid' in pipeline
+    assert mock_cloud_http.calls[-1] == ('GET', cloud.PIPELINES_RESOURCE)
 
 
-@pytest.mark.xfail(reason="timing out")
-def test_write_pipeline():
-    pid = str(uuid.uuid4())
-    status = 'started'
-    res = write_sample_pipeline(pid, status)
+@pytest.mark.parametrize('status', ['started', 'finished', 'error'])
+def test_write_pipeline(mock_api_key, pipeline_ids, status, pid_factory,
+                        capsys):
+    pid = pid_factory()
+    write_sample_pipeline(pid, status)
+    res = capsys.readouterr().out
     assert pid in res
+    pipeline_ids.append(pid)
 
-    res = delete_sample_pipeline(pid)
-    assert pid in res
+    pipeline = cloud.get_pipeline(pid)
+    assert pipeline[0]['status'] == status
 
 
-def test_write_pipeline_no_valid_key(monkeypatch):
+def test_write_pipeline_no_valid_key(monkeypatch, mock_cloud_http,
+                                     pid_factory, capsys):
     key = "2AhdF2MnRDw-ZZZZZZZZZZ"
-    sample_pipeline_id = str(uuid.uuid4())
+    sample_pipeline_id = pid_factory()
     status = 'started'
     cloud_mock = Mock(return_value=key)
     monkeypatch.setattr(cloud, 'get_key', cloud_mock)
-    res = write_sample_pipeline(sample_pipeline_id, status)
+
+    with pytest.warns(UserWarning, match='API_Key not valid'):
+        write_sample_pipeline(sample_pipeline_id, status)
+
+    res = capsys.readouterr().out
     assert 'API_Key' in res
+    assert sample_pipeline_id not in mock_cloud_http.pipelines
 
 
-def test_write_pipeline_no_status_id(monkeypatch):
+def test_write_pipeline_no_status_id(monkeypatch, pid_factory, capsys):
     monkeypatch.setenv('PLOOMBER_CLOUD_KEY', 'TEST_KEY12345678987654')
 
     pipeline_id = ''
     status = 'started'
-    res = write_sample_pipeline(pipeline_id, status)
+    write_sample_pipeline(pipeline_id, status)
+    res = capsys.readouterr().out
     assert 'No input pipeline_id' in res
 
-    pipeline_id = str(uuid.uuid4())
+    pipeline_id = pid_factory()
     status = ''
-    res = write_sample_pipeline(pipeline_id=pipeline_id, status=status)
+    write_sample_pipeline(pipeline_id=pipeline_id, status=status)
+    res = capsys.readouterr().out
     assert 'No input pipeline status' in res
 
 
-@pytest.mark.xfail(reason="timing out")
-def test_write_delete_pipeline():
-    pid = str(uuid.uuid4())
-    status = 'started'
-    res = write_sample_pipeline(pid, status)
-    assert pid in res
-    res = delete_sample_pipeline(pid)
-    assert pid in res
-
-
-@pytest.mark.xfail(reason="timing out")
-def test_delete_non_exist_pipeline():
+def test_delete_non_exist_pipeline(mock_api_key, capsys):
     pid = 'TEST_PIPELINE'
     res = get_tabular_pipeline(pid)
     assert f'{pid} was not' in res
 
-    res = delete_sample_pipeline(pid)
+    delete_sample_pipeline(pid)
+    res = capsys.readouterr().out
     assert 'doesn\'t exist' in res
 
 
-@pytest.mark.xfail(reason="timing out")
-def test_update_existing_pipeline():
-    pid = str(uuid.uuid4())
+def test_update_existing_pipeline(mock_api_key, pid_factory, capsys):
+    pid = pid_factory()
     end_status = 'finished'
-    res = write_sample_pipeline(pipeline_id=pid, status='started')
+    write_sample_pipeline(pipeline_id=pid, status='started')
+    res = capsys.readouterr().out
     assert pid in res
 
-    res = write_sample_pipeline(pipeline_id=pid, status=end_status)
+    write_sample_pipeline(pipeline_id=pid, status=end_status)
+    res = capsys.readouterr().out
     assert pid in res
 
     pipeline = get_tabular_pipeline(pid)
     assert isinstance(pipeline, str)
     assert end_status in pipeline
 
-    res = delete_sample_pipeline(pid)
+    delete_sample_pipeline(pid)
+    res = capsys.readouterr().out
     assert pid in res
 
 
-@pytest.mark.xfail(reason="timing out")
-def test_pipeline_write_error():
-    pid = str(uuid.uuid4())
+def test_pipeline_write_error(mock_api_key, pid_factory, capsys):
+    pid = pid_factory()
     end_status = 'error'
     log = 'Error: issue building the dag'
-    runner = CliRunner()
-    result = runner.invoke(write_pipeline,
-                           args=[pid, end_status, log],
-                           catch_exceptions=False)
+    result = _RUNNER.invoke(write_pipeline,
+                            args=[pid, end_status, log],
+                            catch_exceptions=False)
     assert pid in result.stdout
 
     pipeline = get_tabular_pipeline(pid)
     assert isinstance(pipeline, str)
     assert end_status in pipeline
 
-    res = delete_sample_pipeline(pid)
+    delete_sample_pipeline(pid)
+    res = capsys.readouterr().out
     assert pid in res
 
 
 # Get all pipelines, minimum of 3 should exist.
-@pytest.mark.xfail(reason="timing out")
-def test_get_multiple_pipelines(monkeypatch):
+def test_get_multiple_pipelines(mock_api_key, monkeypatch, pid_factory):
     class CustomTableWrapper(table.Table):
         @classmethod
         def from_dicts(cls, dicts, complete_keys):
@@ -320,36 +275,51 @@ def test_get_multiple_pipelines(monkeypatch):
     # the cli module inside the cli function so we can no longer patch it
     monkeypatch.setattr(table, 'Table', CustomTableWrapper)
 
-    pid = str(uuid.uuid4())
-    pid2 = str(uuid.uuid4())
-    pid3 = str(uuid.uuid4())
+    pids = [pid_factory() for _ in range(3)]
     status = 'finished'
-    res = write_sample_pipeline(pipeline_id=pid, status=status)
-    assert pid in res
-    res = write_sample_pipeline(pipeline_id=pid2, status=status)
-    assert pid2 in res
-    res = write_sample_pipeline(pipeline_id=pid3, status=status)
-    assert pid3 in res
+
+    # CliRunner swaps sys.stdout so it isn't thread-safe, call the cloud
+    # functions directly (skipping telemetry, which writes to the conf file)
+    with ThreadPoolExecutor(max_workers=len(pids)) as executor:
+        results = list(
+            executor.map(lambda pid: cloud._write_pipeline(pid, status),
+                         pids))
+
+    for pid, res in zip(pids, results):
+        assert pid in res
 
     get_tabular_pipeline()
     assert len(CustomTableWrapper.table['pipeline_id']) >= 3
 
-    res = delete_sample_pipeline(pid)
-    assert pid in res
-    res = delete_sample_pipeline(pid2)
-    assert pid2 in res
-    res = delete_sample_pipeline(pid3)
-    assert pid3 in res
+    with ThreadPoolExecutor(max_workers=len(pids)) as executor:
+        results = list(executor.map(cloud._delete_pipeline, pids))
+
+    for pid, res in zip(pids, results):
+        assert pid in res
+
+
+def test_requests_do_not_modify_shared_headers(mock_api_key, mock_cloud_http,
+                                               pid_factory):
+    pid = pid_factory()
+    cloud._write_pipeline(pid, 'started')
+    cloud._delete_pipeline(pid)
 
+    pid = pid_factory()
+    assert pid in cloud._write_pipeline(pid, 'started')
 
-def test_get_latest_pipeline(monkeypatch):
-    pid = str(uuid.uuid4())
+    assert 'pipeline_id' not in mock_cloud_http.headers[-1]
+    assert cloud.headers == {'Content-type': 'application/json'}
+
+
+def test_get_latest_pipeline(monkeypatch, pid_factory, capsys):
+    pid = pid_factory()
     status = 'started'
     api_mock = Mock(return_value=[{"pipeline_id": pid}])
     monkeypatch.setattr(cloud, 'write_pipeline', api_mock)
     monkeypatch.setattr(cloud, 'get_pipeline', api_mock)
 
-    res = write_sample_pipeline(pid, status)
+    write_sample_pipeline(pid, status)
+    res = capsys.readouterr().out
     assert pid in str(res)
 
     pipeline = get_tabular_pipeline('latest')
@@ -357,23 +327,14 @@ def test_get_latest_pipeline(monkeypatch):
     assert pid in pipeline
 
 
-@pytest.mark.xfail(reason="timing out")
-def test_get_active_pipeline(monkeypatch):
-    pid = str(uuid.uuid4())
-    res = write_sample_pipeline(pipeline_id=pid, status='started')
-    assert pid in res
-
+def test_get_active_pipeline(mock_api_key, sample_pipeline):
     # Cutting the pipelineID for the tabular print
     pipeline = get_tabular_pipeline('active')
-    prefix = pid.split("-")[0]
+    prefix = sample_pipeline.split("-")[0]
     assert prefix in pipeline
 
-    res = delete_sample_pipeline(pid)
-    assert pid in res
 
-
-@pytest.mark.xfail(reason="timing out")
-def test_get_pipeline_with_dag(monkeypatch):
+def test_get_pipeline_with_dag(mock_api_key, monkeypatch, pid_factory, capsys):
     dag_mock = Mock(
         return_value={
             "dag_size": "2",
@@ -396,7 +357,7 @@ def test_get_pipeline_with_dag(monkeypatch):
         })
     monkeypatch.setattr(telemetry, 'parse_dag', dag_mock)
 
-    pid = str(uuid.uuid4())
+    pid = pid_factory()
     status = 'finished'
     dag = telemetry.parse_dag("Sample_dag")
     res = cloud.write_pipeline(pipeline_id=pid, status=status, dag=dag)
@@ -408,7 +369,8 @@ def test_get_pipeline_with_dag(monkeypatch):
     res = get_tabular_pipeline(pipeline_id=pid)
     assert 'dag' not in res
 
-    res = delete_sample_pipeline(pid)
+    delete_sample_pipeline(pid)
+    res = capsys.readouterr().out
     assert pid in res
 
 
@@ -423,8 +385,7 @@ def test_malformed_email_signup(monkeypatch, user_email):
 
 
 # Testing valid api calls when the email is correct
-def test_correct_email_signup(tmp_directory, monkeypatch):
-    monkeypatch.setattr(telemetry, 'DEFAULT_HOME_DIR', '.')
+def test_correct_email_signup(monkeypatch):
     registry_mock = Mock()
     monkeypatch.setattr(cloud, '_email_registry', registry_mock)
 
@@ -434,13 +395,11 @@ def test_correct_email_signup(tmp_directory, monkeypatch):
 
 
 # Test valid emails are stored in the user conf
-def test_email_conf_file(tmp_directory, monkeypatch):
+def test_email_conf_file(write_sample_conf, monkeypatch):
     registry_mock = Mock()
     monkeypatch.setattr(cloud, '_email_registry', registry_mock)
-    monkeypatch.setattr(telemetry, 'DEFAULT_HOME_DIR', '.')
 
-    stats = Path('stats')
-    conf_path = stats / telemetry.DEFAULT_USER_CONF
+    conf_path = write_sample_conf
     conf_path.write_text("sample_conf_key: True\n")
 
     sample_email = 'test@example.com'
@@ -450,8 +409,7 @@ def test_email_conf_file(tmp_directory, monkeypatch):
     assert sample_email in conf
 
 
-def test_email_write_only_once(tmp_directory, monkeypatch):
-    monkeypatch.setattr(telemetry, 'DEFAULT_HOME_DIR', '.')
+def test_email_write_only_once(monkeypatch):
     input_mock = Mock(return_value='some1@email.com')
     monkeypatch.setattr(cloud, '_get_input', input_mock)
     monkeypatch.setattr(telemetry.UserSettings, 'user_email', 'some@email.com')